@@ -1,10 +1,32 @@
+import os
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 
-@st.cache
-def load_data(path):
-    dataset = pd.read_csv(path)
+numeric_cols = ['Yield (Tonnes)', 'Average Rainfall (mm)', 'Pesticides (Tonnes)', 'Average Temperature (C)']
+# choropleth colour scale for each display option
+colour_scales = {'Yield (Tonnes)': 'greens',
+                 'Average Rainfall (mm)': 'blues',
+                 'Average Temperature (C)': 'reds'}
+# (column, axis title) for the bar chart, keyed on the normalise checkbox
+y_config = {False: ('Yield (Tonnes)', 'Yield (Tonnes)'),
+            True: ('Normalised Yield (Tonnes)', 'Normalised Yield (%)')}
+
+# max_entries hold about one csv's worth of results, so entries for an old mtime get evicted
+@st.cache_data(show_spinner=False, max_entries=1)
+def load_data(path, mtime):
+    dataset = pd.read_csv(path,
+                          engine='pyarrow',
+                          usecols=['Area', 'Item', 'Year', 'hg/ha_yield', 'average_rain_fall_mm_per_year',
+                                   'pesticides_tonnes', 'avg_temp'], # skip the unnamed index column
+                          dtype={'Area': 'category', # repeated strings, stored as int codes
+                                 'Item': 'category',
+                                 'Year': 'int16',
+                                 'hg/ha_yield': 'float32',
+                                 'average_rain_fall_mm_per_year': 'float32',
+                                 'pesticides_tonnes': 'float32',
+                                 'avg_temp': 'float32'})
     dataset.rename(columns = {'hg/ha_yield':'Yield (Tonnes)',
                               'average_rain_fall_mm_per_year':'Average Rainfall (mm)',
                               'pesticides_tonnes':'Pesticides (Tonnes)',
@@ -12,33 +34,134 @@ def load_data(path):
                    inplace=True)
     return dataset
 
-@st.cache
-def clean_average_data(df, countries, crops, years):
-    main_df = df[df['Area'].str.strip().astype(bool)] #drop blanks
-    main_df = main_df.drop('Unnamed: 0', axis=1) #drop column we dont need
-    main_df.sort_values(by=['Area', 'Year'], inplace=True, ascending=[True, True])
+@st.cache_data(show_spinner=False, max_entries=1)
+def clean_average_data(path, mtime):
+    df = load_data(path, mtime)
+    blank_areas = [area for area in df['Area'].cat.categories if not area.strip()]
+    main_df = df[~df['Area'].isin(blank_areas)] #drop blanks, checked per category rather than per row
 
-    ave_df = pd.DataFrame(columns=main_df.columns) # new df to append to
     # take average for countries, year and crop that repeat in raw dataset
-    # a faster method would need to be used for a real customer facing dashboard but the cache helps for now
-    for country in countries:
-        country_df = main_df[main_df['Area'] == country]
-        for crop in crops:
-            country_crop_df = country_df[country_df['Item'] == crop]
-            for year in years:
-                country_crop_year_df = country_crop_df[country_crop_df['Year'] == year]
-                temp_stats = country_crop_year_df.mean(axis=0)
-                temp_data = [country, crop, year,
-                             temp_stats['Yield (Tonnes)'],
-                             temp_stats['Average Rainfall (mm)'],
-                             temp_stats['Pesticides (Tonnes)'],
-                             temp_stats['Average Temperature (C)']]
-                temp_df = pd.DataFrame([temp_data], columns=main_df.columns)
-                ave_df = pd.concat([ave_df, temp_df], ignore_index=True)
-    ave_df = ave_df[ave_df['Yield (Tonnes)'].notna()]
-    ave_df.sort_values(by=['Area', 'Year'], inplace=True, ascending=[True, True])
+    ave_df = main_df.groupby(['Area', 'Item', 'Year'], as_index=False, observed=True)[numeric_cols].mean()
+    ave_df = ave_df.dropna(subset=['Yield (Tonnes)'])
+
+    # yield per tonne of pesticide and per mm of rainfall, left blank where nothing was used
+    yield_values = ave_df['Yield (Tonnes)'].to_numpy()
+    for ratio_col, denom_col in [('Yield/ Pesticides', 'Pesticides (Tonnes)'),
+                                 ('Yield/ Rainfall', 'Average Rainfall (mm)')]:
+        denom = ave_df[denom_col].to_numpy()
+        ave_df[ratio_col] = np.divide(yield_values, denom, where=denom != 0, out=np.full_like(yield_values, np.nan))
+
+    ave_df = ave_df.sort_values(by=['Area', 'Year'], kind='stable', ignore_index=True) # categorical Area sorts on its codes
     return ave_df
 
+@st.cache_resource(show_spinner=False, max_entries=2) # 'Area' and 'Item'
+def split_by(path, mtime, col):
+    ave_df = clean_average_data(path, mtime)
+    # group once so each widget change is a dict lookup rather than a scan of the whole frame
+    # shared rather than copied per call, so callers must not modify the returned frames
+    return {k: v.reset_index(drop=True) for k, v in ave_df.groupby(col, sort=False, observed=True)}
+
+def get_group(path, mtime, col, key):
+    groups = split_by(path, mtime, col)
+    if key in groups:
+        return groups[key]
+    # nothing left for this selection after the clean up, so plot an empty frame
+    return clean_average_data(path, mtime).iloc[:0]
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def load_csv_bytes(path, mtime):
+    with open(path, 'rb') as f:
+        return f.read()
+
+# figures are cached so reruns from unrelated widgets reuse them instead of rebuilding
+@st.cache_resource(show_spinner=False, max_entries=1)
+def build_total_yield_line(path, mtime):
+    ave_df = clean_average_data(path, mtime)
+    # calculate total for crop yield per country and year
+    ave_pivot_df = ave_df.groupby(['Area', 'Year'], as_index=False, observed=True)[['Yield (Tonnes)']].mean()
+
+    fig1 = px.line(ave_pivot_df,
+                   x='Year',
+                   y='Yield (Tonnes)',
+                   color='Area',
+                   labels={'Area':'Country'},
+                   title='Total crop yield per country per year.',
+                   color_discrete_sequence=px.colors.qualitative.Pastel)
+    fig1.update_layout(xaxis_title='Year',
+                       yaxis_title='Total crop yield (Tonnes)')
+    fig1.update_traces(opacity=0.9)
+    return fig1
+
+@st.cache_resource(show_spinner=False, max_entries=50) # ~10 crops x 3 display options
+def build_choropleth(path, mtime, crop_sec1, display_sec1):
+    # filter for the crop
+    crop_sec1_df = get_group(path, mtime, 'Item', crop_sec1)
+    # only keep the columns the map uses
+    plot_cols = list(dict.fromkeys(['Area', 'Year', 'Item', 'Yield (Tonnes)', display_sec1]))
+
+    # show choropleth for yield, rainfall, temp
+    fig2 = px.choropleth(crop_sec1_df[plot_cols],
+                         locations="Area",
+                         color=display_sec1,
+                         hover_name='Area',
+                         hover_data=['Item', 'Year', 'Yield (Tonnes)'],
+                         locationmode='country names',
+                         animation_frame='Year',
+                         range_color=([0, crop_sec1_df[display_sec1].max()]),
+                         color_continuous_scale=colour_scales[display_sec1],
+                         labels={'Item':'Crop', 'Area':'Country'},
+                         title='Animated choropleth world map showing '+display_sec1+' per country.')
+    fig2.update_layout(margin={"r": 50, "t": 50, "l": 0, "b": 0})
+    return fig2
+
+@st.cache_resource(show_spinner=False, max_entries=250) # ~100 countries x normalise on/off
+def build_composition_bar(path, mtime, country_sec2, normalise_sec2):
+    # filter df for country
+    country_sec2_df = get_group(path, mtime, 'Area', country_sec2).copy()
+    #normalise the yield per crop for each year
+    year_total = country_sec2_df.groupby('Year')['Yield (Tonnes)'].transform('sum')
+    country_sec2_df['Normalised Yield (Tonnes)'] = 100*country_sec2_df['Yield (Tonnes)'].to_numpy()/year_total.to_numpy()
+
+    # bar chart showing yield in tonnes per country
+    y_plot, y_title = y_config[normalise_sec2]
+    fig3 = px.bar(country_sec2_df,
+                  x='Year',
+                  y=y_plot,
+                  color='Item',
+                  barmode='stack',
+                  title='Crop composition per year, for '+country_sec2+'.',
+                  labels={'Item':'Crop'},
+                  color_discrete_sequence=px.colors.qualitative.Pastel)
+    fig3.update_layout(xaxis_title='Year',
+                       yaxis_title=y_title)
+    return fig3
+
+# not keyed on the normalise checkbox, so toggling it leaves this untouched
+@st.cache_resource(show_spinner=False, max_entries=150) # ~100 countries
+def build_ratio_lines(path, mtime, country_sec2):
+    country_sec2_df = get_group(path, mtime, 'Area', country_sec2)
+
+    # yield (tonne) per tonne of pesticide used and per mm rainfall, coloured by crop, one panel each
+    ratio_titles = {'Yield/ Pesticides': 'Yield per tonne of<br>pesticide used (Tonnes)',
+                    'Yield/ Rainfall': 'Yield per mm of<br>rainfall (Tonnes)'}
+    ratio_df = country_sec2_df.melt(id_vars=['Year', 'Item'],
+                                    value_vars=list(ratio_titles),
+                                    var_name='Ratio',
+                                    value_name='Value')
+    fig4 = px.line(ratio_df,
+                   x='Year',
+                   y='Value',
+                   color='Item',
+                   facet_row='Ratio',
+                   category_orders={'Ratio': list(ratio_titles)},
+                   labels={'Item':'Crop'},
+                   title='Crop yield per tonne of pesticide used and per mm of rainfall per year, for '+country_sec2+'.',
+                   color_discrete_sequence=px.colors.qualitative.Pastel,
+                   height=700)
+    fig4.update_yaxes(matches=None, title_text='') # the two ratios are on very different scales
+    fig4.for_each_annotation(lambda a: a.update(text=ratio_titles[a.text.split('=')[-1]]))
+    return fig4
+
 with st.sidebar:
     st.write('Welcome to my dashboard :wave:')
     st.write('')
@@ -63,15 +186,12 @@ st.title(':seedling: Agricultural yield dashboard :seedling:')
 
 # load in data
 load_path = 'data/yield_df.csv'
-raw_df = load_data(load_path)
+load_mtime = os.path.getmtime(load_path) # part of the cache key so an updated csv is reloaded
+raw_df = load_data(load_path, load_mtime)
 
-# get some variable lists to help
-countries = raw_df['Area'].drop_duplicates()
-crops = raw_df['Item'].drop_duplicates()
-years = raw_df['Year'].drop_duplicates()
-
-# Perform some quick data clean up and sorting
-ave_df = clean_average_data(raw_df, countries, crops, years)
+# get some variable lists to help, only offering values that survive the clean up
+countries = tuple(sorted(split_by(load_path, load_mtime, 'Area')))
+crops = tuple(sorted(split_by(load_path, load_mtime, 'Item')))
 
 
 ######################################## section 1 #################################################
@@ -91,22 +211,7 @@ Instead, it would be better to investigate crops individually.
 ''')
 
 
-# calculate total for crop yield per country and year
-ave_pivot_df = pd.pivot_table(ave_df, index=['Area', 'Year'])
-ave_pivot_df['Area'] = ave_pivot_df.index.get_level_values(0)
-ave_pivot_df['Year'] = ave_pivot_df.index.get_level_values(1)
-
-fig1 = px.line(ave_pivot_df,
-               x='Year',
-               y='Yield (Tonnes)',
-               color='Area',
-               labels={'Area':'Country'},
-               title='Total crop yield per country per year.',
-               color_discrete_sequence=px.colors.qualitative.Pastel)
-fig1.update_layout(xaxis_title='Year',
-                   yaxis_title='Total crop yield (Tonnes)')
-fig1.update_traces(opacity=0.9)
-st.plotly_chart(fig1)
+st.plotly_chart(build_total_yield_line(load_path, load_mtime))
 
 st.markdown('''  
 Therefore, I decided to use a choropleth to show each crop separately. 
@@ -120,31 +225,9 @@ col1, col2 = st.columns([3, 2])
 with col1:
     crop_sec1 = st.selectbox('Crop', crops)
 with col2:
-    display_sec1 = st.selectbox('Display:', ['Yield (Tonnes)', 'Average Rainfall (mm)', 'Average Temperature (C)'])
-
-# filter for the crop
-crop_sec1_df = ave_df[ave_df['Item'] == crop_sec1]
-
-# show choropleth for yield, rainfall, temp
-if display_sec1 == 'Yield (Tonnes)':
-    this_colour_scale = 'greens'
-elif display_sec1 == 'Average Rainfall (mm)':
-    this_colour_scale = 'blues'
-elif display_sec1 == 'Average Temperature (C)':
-    this_colour_scale = 'reds'
-fig2 = px.choropleth(crop_sec1_df,
-                     locations="Area",
-                     color=display_sec1,
-                     hover_name='Area',
-                     hover_data=['Item', 'Year', 'Yield (Tonnes)'],
-                     locationmode='country names',
-                     animation_frame='Year',
-                     range_color=([0, crop_sec1_df[display_sec1].max()]),
-                     color_continuous_scale=this_colour_scale,
-                     labels={'Item':'Crop', 'Area':'Country'},
-                     title='Animated choropleth world map showing '+display_sec1+' per country.')
-fig2.update_layout(margin={"r": 50, "t": 50, "l": 0, "b": 0})
-st.plotly_chart(fig2)
+    display_sec1 = st.selectbox('Display:', list(colour_scales))
+
+st.plotly_chart(build_choropleth(load_path, load_mtime, crop_sec1, display_sec1))
 
 st.markdown('''
 _Future analysis for this section could include comparing crop yield with other factors, such as 
@@ -176,30 +259,7 @@ of total crop yield crops, or they can compare how the distribution of crops has
 country_sec2 = st.selectbox('Country', countries)
 normalise_sec2 = st.checkbox('Normalise yield?')
 
-# filter df for country
-country_sec2_df = ave_df[ave_df['Area'] == country_sec2]
-#normalise the yield per crop for each year
-country_sec2_df['Normalised Yield (Tonnes)'] = \
-    100*country_sec2_df['Yield (Tonnes)']/country_sec2_df.groupby('Year')['Yield (Tonnes)'].transform(sum)
-
-# bar chart showing yield in tonnes per country
-if normalise_sec2 == False:
-    y_plot = 'Yield (Tonnes)'
-    y_title = 'Yield (Tonnes)'
-elif normalise_sec2 == True:
-    y_plot = 'Normalised Yield (Tonnes)'
-    y_title = 'Normalised Yield (%)'
-fig3 = px.bar(country_sec2_df,
-              x='Year',
-              y=y_plot,
-              color='Item',
-              barmode='stack',
-              title='Crop composition per year, for '+country_sec2+'.',
-              labels={'Item':'Crop'},
-              color_discrete_sequence=px.colors.qualitative.Pastel)
-fig3.update_layout(xaxis_title='Year',
-                   yaxis_title=y_title)
-st.plotly_chart(fig3)
+st.plotly_chart(build_composition_bar(load_path, load_mtime, country_sec2, normalise_sec2))
 
 st.markdown('''
 I have also decided to include a line graphs to show the pesticide and rainfall impact on yield, 
@@ -207,31 +267,7 @@ as this is a quantitative relationship.
 The audience would likely want to see the trends, as well as easily read off the values.
 ''')
 
-# yield (tonne) per tonne of pesticide used, coloured by crop
-country_sec2_df['Yield/ Pesticides'] = country_sec2_df['Yield (Tonnes)']/country_sec2_df['Pesticides (Tonnes)']
-fig4 = px.line(country_sec2_df,
-               x='Year',
-               y='Yield/ Pesticides',
-               color='Item',
-               labels={'Item':'Crop'},
-               title='Crop yield per tonne of pesticide used per year, for '+country_sec2+'.',
-               color_discrete_sequence=px.colors.qualitative.Pastel)
-fig4.update_layout(xaxis_title='Year',
-                   yaxis_title='Yield per tonne of pesticide used (Tonnes)')
-st.plotly_chart(fig4)
-
-# yield (tonne) per mm rainfall, coloured by crop
-country_sec2_df['Yield/ Rainfall'] = country_sec2_df['Yield (Tonnes)']/country_sec2_df['Average Rainfall (mm)']
-fig5 = px.line(country_sec2_df,
-               x='Year',
-               y='Yield/ Rainfall',
-               color='Item',
-               labels={'Item':'Crop'},
-               title='Crop yield per mm of rainfall per year, for '+country_sec2+'.',
-               color_discrete_sequence=px.colors.qualitative.Pastel)
-fig5.update_layout(xaxis_title='Year',
-                   yaxis_title='Yield per mm of rainfall (Tonnes)')
-st.plotly_chart(fig5)
+st.plotly_chart(build_ratio_lines(load_path, load_mtime, country_sec2))
 
 st.markdown('''
 _Future analysis for this section could include comparing these graphs to crop prices.
@@ -250,7 +286,11 @@ st.markdown('''
 [Kaggle](https://www.kaggle.com/datasets/patelris/crop-yield-prediction-dataset?resource=download&select=yield_df.csv) 
 ''')
 
-raw_df
+st.dataframe(raw_df, height=400)
+st.download_button('Download raw CSV',
+                   data=load_csv_bytes(load_path, load_mtime),
+                   file_name=os.path.basename(load_path),
+                   mime='text/csv')
 
 
 